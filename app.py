@@ -1,20 +1,80 @@
+import time
+
+_SCRIPT_START = time.perf_counter()
+
+import os
 import streamlit as st
 import pickle
-import pandas as pd
 import sqlite3
-import requests
-import time
 import random
 from urllib.parse import quote
-from streamlit_lottie import st_lottie
+from popularity import PopularityEngine
+from auth import authenticate, hash_password_in_pool, LoginThrottled, AuthBusy
+from book_details import (create_book_details_table, refresh_book_details, invalidate_book_details,
+                          get_book_details, save_book_metadata, METADATA_TTL)
+
+# requests (via _http()) and pandas (pulled in by unpickling the models) are only imported once the
+# main app needs them, so the login and welcome pages do not pay for them.
+_IMPORTS_DONE = time.perf_counter()
 
 st.set_page_config(layout="wide", page_title="Book Recommender 📚", page_icon="📖")
 
+# Set BOOK_RECOMMENDER_PROFILE=1 to show the process's import cost and each page's script run time.
+# For a per-module breakdown, start the server with: python -X importtime -m streamlit run app.py
+PROFILE_STARTUP = os.environ.get("BOOK_RECOMMENDER_PROFILE") == "1"
+
+
+# Reruns find every module already in sys.modules, so only the first run of the process measures
+# what importing actually costs; it is kept here for later runs to report.
+@st.cache_resource(show_spinner=False)
+def process_import_cost():
+    return {'ms': (_IMPORTS_DONE - _SCRIPT_START) * 1000}
+
+
+def report_startup_timing(stage):
+    if not PROFILE_STARTUP:
+        return
+    imports_ms = process_import_cost()['ms']
+    run_ms = (time.perf_counter() - _SCRIPT_START) * 1000
+    message = f"[startup] {stage}: imports (first run of process) {imports_ms:.1f} ms, script run time {run_ms:.1f} ms"
+    print(message)
+    st.caption(message)
+
+
+if PROFILE_STARTUP:
+    process_import_cost()
+
+
 GOOGLE_BOOKS_API_KEY = st.secrets["google_api_key"]
 GOOGLE_API_URL = "https://www.googleapis.com/books/v1/volumes?q=intitle:{}&key=" + GOOGLE_BOOKS_API_KEY
 BOOK_RECOMMENDER_LOGO = "Book-recommender-logo.png"
 
 
+# Deferred import of requests; after the first call this is just a sys.modules lookup.
+def _http():
+    import requests
+    return requests
+
+
+# --------------------------- POPULARITY ---------------------------
+# Shared by all sessions: live views/reviews blended with the static popular.pkl ranking.
+@st.cache_resource(show_spinner=False)
+def get_popularity_engine():
+    popular_df = pickle.load(open('popular.pkl', 'rb'))
+    _, _, book_list, _ = load_similarity_model()
+    return PopularityEngine(popular_df['Book-Title'].tolist(), known_titles=book_list)
+
+
+# Loaded once per process: the similarity model plus a title -> row lookup for it.
+@st.cache_resource(show_spinner=False)
+def load_similarity_model():
+    pt = pickle.load(open('pt.pkl', 'rb'))
+    similarity_scores = pickle.load(open('similarity_scores.pkl', 'rb'))
+    book_list = pt.index.tolist()
+    book_positions = {title: i for i, title in enumerate(book_list)}
+    return pt, similarity_scores, book_list, book_positions
+
+
 # --------------------------- DATABASE SETUP ---------------------------
 def create_users_table():
     conn = sqlite3.connect("users_book.db")
@@ -67,6 +127,11 @@ def create_fav_and_history_tables():
         book_title
                  )
         )''')
+    # Dataset title the review was written from; book_title is the Google Books title shown to the user.
+    c.execute("PRAGMA table_info(reviews)")
+    if 'source_title' not in [column[1] for column in c.fetchall()]:
+        c.execute("ALTER TABLE reviews ADD COLUMN source_title TEXT")
+    create_book_details_table(conn)
     conn.commit()
     conn.close()
 
@@ -80,10 +145,11 @@ def add_user(username, password):
         st.error("Username must contain at least one letter and cannot be empty or just numbers.")
         return False
 
+    password_hash = hash_password_in_pool(password)
     conn = sqlite3.connect("users_book.db")
     c = conn.cursor()
     try:
-        c.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username_stripped, password))
+        c.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username_stripped, password_hash))
         conn.commit()
         return True
     except sqlite3.IntegrityError:
@@ -93,13 +159,11 @@ def add_user(username, password):
 
 
 
+# Checks the password against its stored hash, upgrading old or plaintext hashes on success.
+# Raises LoginThrottled after too many failures and AuthBusy when the KDF pool is saturated.
 def validate_user(username, password):
-    conn = sqlite3.connect("users_book.db")
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE username=? AND password=?", (username.strip(), password))
-    result = c.fetchone()
-    conn.close()
-    return result
+    ip_address = getattr(st.context, "ip_address", None)
+    return authenticate(username.strip(), password, ip_address)
 
 
 def add_to_history(username, book_title):
@@ -108,6 +172,7 @@ def add_to_history(username, book_title):
     c.execute("INSERT INTO history (username, book_title) VALUES (?, ?)", (username, book_title))
     conn.commit()
     conn.close()
+    get_popularity_engine().record_view(username, book_title)
 
 
 def get_history(username):
@@ -128,36 +193,37 @@ def clear_history(username):
     conn.close()
 
 
-def add_review(username, book_title, review_text):
+# source_title is the dataset title the book was recommended under; popularity is counted against it.
+def add_review(username, book_title, review_text, source_title=None):
     conn = sqlite3.connect("users_book.db")
     c = conn.cursor()
     try:
-        c.execute("INSERT INTO reviews (username, book_title, review_text) VALUES (?, ?, ?)",
-                  (username, book_title, review_text))
+        try:
+            c.execute("INSERT INTO reviews (username, book_title, review_text, source_title) VALUES (?, ?, ?, ?)",
+                      (username, book_title, review_text, source_title))
+        except sqlite3.IntegrityError:
+            c.execute(
+                "UPDATE reviews SET review_text = ?, source_title = ?, timestamp = CURRENT_TIMESTAMP "
+                "WHERE username = ? AND book_title = ?",
+                (review_text, source_title, username, book_title))
+        # Keep the book's detail page in step with its reviews, in the same transaction
+        refresh_book_details(conn, book_title)
         conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        c.execute(
-            "UPDATE reviews SET review_text = ?, timestamp = CURRENT_TIMESTAMP WHERE username = ? AND book_title = ?",
-            (review_text, username, book_title))
-        conn.commit()
-        return True
     finally:
         conn.close()
+    invalidate_book_details(book_title)
+    get_popularity_engine().record_review(username, source_title or book_title)
+    return True
 
 
-def get_reviews(book_title):
-    conn = sqlite3.connect("users_book.db")
-    c = conn.cursor()
-    c.execute("SELECT username, review_text, timestamp FROM reviews WHERE book_title=? ORDER BY timestamp DESC",
-              (book_title,))
-    results = c.fetchall()
-    conn.close()
-    return results
+# Schema creation only needs to happen once per server process, not on every rerun.
+@st.cache_resource(show_spinner=False)
+def init_db():
+    create_users_table()
+    create_fav_and_history_tables()
 
 
-create_users_table()
-create_fav_and_history_tables()
+init_db()
 
 # --------------------------- SESSION STATE ---------------------------
 if 'logged_in' not in st.session_state:
@@ -181,13 +247,18 @@ if not st.session_state.logged_in:
         username = st.text_input("Username", key="login_user")
         password = st.text_input("Password", type="password", key="login_pass")
         if st.button("Login"):
-            if validate_user(username, password):
+            try:
+                login_ok = validate_user(username, password)
+            except (LoginThrottled, AuthBusy) as e:
+                st.error(str(e))
+                login_ok = None
+            if login_ok:
                 st.success("Logged in successfully! ✅")
                 st.session_state.logged_in = True
                 st.session_state.username = username.strip()
                 st.session_state.show_welcome = True  # Show welcome screen after successful login
                 st.rerun()
-            else:
+            elif login_ok is False:
                 st.error("Invalid credentials.")
 
     with tab2:
@@ -195,12 +266,18 @@ if not st.session_state.logged_in:
         new_pass = st.text_input("New Password", type="password")
         if st.button("Register"):
             if new_user and new_pass:
-                if add_user(new_user, new_pass):
+                try:
+                    registered = add_user(new_user, new_pass)
+                except AuthBusy as e:
+                    st.error(str(e))
+                    registered = None
+                if registered:
                     st.success("User registered! Please log in. 🎉")
-                else:
+                elif registered is False:
                     st.error("Username already exists. Please choose a different one.")
             else:
                 st.warning("Please fill both fields.")
+    report_startup_timing("login")
     st.stop()  # Stop execution here if not logged in
 
 # --------------------------- Personalized Welcome Dashboard ---------------------------
@@ -232,14 +309,14 @@ if st.session_state.logged_in and st.session_state.show_welcome:
             st.rerun()
 
     st.markdown("<br>", unsafe_allow_html=True)  # Add some space at the bottom
+    report_startup_timing("welcome")
     st.stop()  # Stop here until user clicks to explore
 
 # --------------------------- LOAD DATA ---------------------------
 if st.session_state.logged_in and st.session_state.show_main_app:
     with st.spinner("Loading book data..."):
-        popular_df = pickle.load(open('popular.pkl', 'rb'))
-        pt = pickle.load(open('pt.pkl', 'rb'))
-        similarity_scores = pickle.load(open('similarity_scores.pkl', 'rb'))
+        popularity = get_popularity_engine()
+        pt, similarity_scores, book_list, book_positions = load_similarity_model()
     st.success("Data loaded! Ready to recommend. ✅")
 
     # --------------------------- GOOGLE BOOKS API ---------------------------
@@ -248,7 +325,7 @@ if st.session_state.logged_in and st.session_state.show_main_app:
         full_url = GOOGLE_API_URL.format(query)
         for attempt in range(retries):
             try:
-                response = requests.get(full_url, timeout=5)
+                response = _http().get(full_url, timeout=5)
                 if response.status_code == 200:
                     items = response.json().get('items')
                     if items:
@@ -262,7 +339,8 @@ if st.session_state.logged_in and st.session_state.show_main_app:
                             'author': ', '.join(volume_info.get('authors', ['Unknown'])),
                             'image_url': image_url,
                             'description': volume_info.get('description', 'No description available.'),
-                            'publisher': volume_info.get('publisher', 'Unknown')
+                            'publisher': volume_info.get('publisher', 'Unknown'),
+                            'found': True
                         }
                 else:
                     st.warning(f"API Error: {response.status_code}")
@@ -276,10 +354,11 @@ if st.session_state.logged_in and st.session_state.show_main_app:
             'author': 'Unknown',
             'image_url': '',
             'description': 'No description available.',
-            'publisher': 'Unknown'
+            'publisher': 'Unknown',
+            'found': False  # Placeholder; never stored as the book's metadata
         }
 
-    @st.cache_data(show_spinner=False)
+    @st.cache_data(show_spinner=False, ttl=METADATA_TTL)
     def get_book_info_cached(title):
         return get_book_info_from_google(title)
 
@@ -328,17 +407,21 @@ if st.session_state.logged_in and st.session_state.show_main_app:
     with tabs[0]:
         st.header('🔍 Discover Books A New World! 🌍')
 
-        book_list = pt.index.tolist()
-        selected_book = st.selectbox("Type or select a book from the dropdown", book_list)
-
-        if st.button("Show Recommendation ✨"):
-            index = book_list.index(selected_book)
-            distances = sorted(list(enumerate(similarity_scores[index])), reverse=True, key=lambda x: x[1])
-            recommended_books = []
-            for i in distances[1:7]:
-                title = pt.index[i[0]]
-                info = get_book_info_cached(title)
-                recommended_books.append(info)
+        # Titles typed in that are not in the list are accepted and get popularity-based picks
+        selected_book = st.selectbox("Type or select a book from the dropdown", book_list,
+                                     accept_new_options=True)
+
+        if st.button("Show Recommendation ✨") and selected_book:
+            titles = []
+            index = book_positions.get(selected_book)
+            if index is not None:
+                distances = sorted(list(enumerate(similarity_scores[index])), reverse=True, key=lambda x: x[1])
+                titles = [pt.index[i[0]] for i in distances[1:7]]
+            if not titles:
+                # Unknown to the similarity model: fall back to what is popular right now
+                titles = popularity.fallback(exclude={selected_book}, n=6)
+            # Keep the dataset title next to Google's, so reviews count towards the right book
+            recommended_books = [dict(get_book_info_cached(title), source_title=title) for title in titles]
             st.session_state.recommended_books = recommended_books
             st.session_state.details_index = None
             add_to_history(st.session_state.username, selected_book)
@@ -355,6 +438,15 @@ if st.session_state.logged_in and st.session_state.show_main_app:
 
         if 'details_index' in st.session_state and st.session_state.details_index is not None:
             book = st.session_state.recommended_books[st.session_state.details_index]
+            source_title = book.get('source_title')
+            # One lookup (usually served from memory) for everything the pane shows
+            details = get_book_details(book['title'])
+            if details['metadata'] is None:
+                # Missing or expired; only keep what Google actually returned
+                if book.get('found'):
+                    save_book_metadata(book['title'], {k: v for k, v in book.items() if k != 'source_title'})
+            else:
+                book = details['metadata']
             st.markdown("---")
             st.subheader(f"📘 {book['title']}")
             if book['image_url']:
@@ -380,15 +472,16 @@ if st.session_state.logged_in and st.session_state.show_main_app:
             review_text = st.text_area("Your review", height=100)
             if st.button("Submit Review", key=f"submit_review_{book['title']}"):
                 if review_text:
-                    if add_review(st.session_state.username, book['title'], review_text):
+                    if add_review(st.session_state.username, book['title'], review_text, source_title):
+                        details = get_book_details(book['title'])
                         st.success("Review submitted successfully! 👍")
                     else:
                         st.error("Failed to submit review.")
                 else:
                     st.warning("Please write your review before submitting.")
 
-            st.subheader("💬 User Reviews")
-            reviews = get_reviews(book['title'])
+            st.subheader(f"💬 User Reviews ({details['review_count']})")
+            reviews = details['reviews']
             if reviews:
                 for user, review, timestamp in reviews:
                     st.markdown(f"{user} on {timestamp.split()[0]}:")
@@ -400,13 +493,13 @@ if st.session_state.logged_in and st.session_state.show_main_app:
     # --------------------------- TAB 2: TOP 50 BOOKS ---------------------------
     with tabs[1]:
         st.header("🌟 Top 50 Popular Books")
-        top_books = popular_df.head(50)
+        top_books = popularity.top(50)
         for i in range(0, 50, 5):
             cols = st.columns(5)
             for j in range(5):
                 idx = i + j
                 if idx < len(top_books):
-                    title = top_books.iloc[idx]['Book-Title']
+                    title = top_books[idx]
                     info = get_book_info_cached(title)  # Ensure this is cached
                     with cols[j]:
                         st.subheader(info['title'])  # Changed to subheader
@@ -422,7 +515,7 @@ with tabs[2]:
     if st.button("Search"):
         if query:
             with st.spinner("Searching Google Books..."):  # Added spinner
-                response = requests.get(GOOGLE_API_URL.format(quote(query)), timeout=5)
+                response = _http().get(GOOGLE_API_URL.format(quote(query)), timeout=5)
                 data = response.json()
             if "items" in data:
                 for i, item in enumerate(data["items"][:6]):  # Limiting to 6 for display
@@ -508,7 +601,7 @@ with tabs[3]:
             for genre in selected_genres:
                 st.markdown(f"---\n### 📚 Books for {genre.title()}")
                 with st.spinner(f"Finding {genre} books..."):  # Added spinner
-                    response = requests.get(GOOGLE_API_URL.format(quote(genre)), timeout=5)
+                    response = _http().get(GOOGLE_API_URL.format(quote(genre)), timeout=5)
                     data = response.json()
                 if "items" in data:
                     for i, item in enumerate(data["items"][:3]):
@@ -565,7 +658,7 @@ with tabs[4]:
         keywords = ["adventure", "mystery", "inspiration", "science", "life", "technology"]
         query = random.choice(keywords)
         url = f"https://www.googleapis.com/books/v1/volumes?q={query}"
-        response = requests.get(url)
+        response = _http().get(url)
         data = response.json()
         if "items" in data:
             item = random.choice(data["items"])
@@ -744,4 +837,6 @@ with tabs[6]:  # This assumes it's the 7th tab (index 6)
         "The app utilizes the Google Books API for live searches and detailed book information. Book recommendations are powered by a machine learning model trained on a comprehensive dataset to calculate book similarities.")
     st.write(
         "This application is built with Streamlit and Python, demonstrating a simple and interactive way to explore books.")
-    st.caption("© 2025 Book Recommender. All rights reserved.")
\ No newline at end of file
+    st.caption("© 2025 Book Recommender. All rights reserved.")
+
+report_startup_timing("main app")
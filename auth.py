@@ -0,0 +1,308 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+DB_PATH = "users_book.db"
+
+# Scheme used for new and upgraded hashes: "pbkdf2_sha256" or "scrypt". Costs can be tuned per deployment;
+# stored hashes with other parameters keep working and are re-hashed on the next successful login.
+KDF = os.environ.get("BOOK_RECOMMENDER_KDF", "pbkdf2_sha256")
+PBKDF2_ITERATIONS = int(os.environ.get("BOOK_RECOMMENDER_PBKDF2_ITERATIONS", 600_000))
+SCRYPT_N = int(os.environ.get("BOOK_RECOMMENDER_SCRYPT_N", 2 ** 14))
+SCRYPT_R = 8
+SCRYPT_P = 1
+KDFS = ("pbkdf2_sha256", "scrypt")
+if KDF not in KDFS:
+    raise ValueError(f"BOOK_RECOMMENDER_KDF must be one of {', '.join(KDFS)}, not {KDF!r}")
+
+# KDF work runs here so a burst of logins cannot take every core; extra requests wait in a bounded queue.
+KDF_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+KDF_QUEUE = 4 * KDF_WORKERS
+KDF_QUEUE_TIMEOUT = 10
+
+# Failed attempts allowed per username (per username and IP when the IP is known) / per client IP
+# within THROTTLE_WINDOW seconds.
+MAX_FAILURES_PER_USER = 5
+MAX_FAILURES_PER_IP = 20
+THROTTLE_WINDOW = 300
+# Upper bound on usernames / IPs tracked at once; the least recently failing ones are dropped first.
+THROTTLE_MAX_KEYS = 10_000
+
+# Successful logins are remembered for this long so reruns and re-logins skip the KDF.
+LOGIN_CACHE_TTL = 300
+LOGIN_CACHE_SIZE = 1024
+
+
+class LoginThrottled(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Too many failed attempts. Try again in {int(retry_after) + 1} seconds.")
+        self.retry_after = retry_after
+
+
+class AuthBusy(Exception):
+    pass
+
+
+# --------------------------- PASSWORD HASHES ---------------------------
+# Stored formats:
+#   pbkdf2_sha256$<iterations>$<salt>$<hash>
+#   scrypt$<n>$<r>$<p>$<salt>$<hash>
+#   anything else is a legacy plaintext password
+def _b64encode(raw):
+    return base64.b64encode(raw).decode("ascii")
+
+
+def _b64decode(text):
+    return base64.b64decode(text.encode("ascii"))
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r + 1024 * 1024)
+
+
+def hash_password(password, kdf=None, cost=None):
+    kdf = kdf or KDF
+    salt = secrets.token_bytes(16)
+    if kdf == "pbkdf2_sha256":
+        iterations = cost or PBKDF2_ITERATIONS
+        return f"pbkdf2_sha256${iterations}${_b64encode(salt)}${_b64encode(_pbkdf2(password, salt, iterations))}"
+    if kdf == "scrypt":
+        n = cost or SCRYPT_N
+        digest = _scrypt(password, salt, n, SCRYPT_R, SCRYPT_P)
+        return f"scrypt${n}${SCRYPT_R}${SCRYPT_P}${_b64encode(salt)}${_b64encode(digest)}"
+    raise ValueError(f"Unknown KDF: {kdf}")
+
+
+def verify_password(password, stored):
+    parts = stored.split("$")
+    try:
+        if parts[0] == "pbkdf2_sha256" and len(parts) == 4:
+            digest = _pbkdf2(password, _b64decode(parts[2]), int(parts[1]))
+            return hmac.compare_digest(digest, _b64decode(parts[3]))
+        if parts[0] == "scrypt" and len(parts) == 6:
+            n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+            digest = _scrypt(password, _b64decode(parts[4]), n, r, p)
+            return hmac.compare_digest(digest, _b64decode(parts[5]))
+    except ValueError:
+        return False
+    # Legacy plaintext row
+    return hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8"))
+
+
+def needs_rehash(stored):
+    parts = stored.split("$")
+    if KDF == "pbkdf2_sha256":
+        return not (parts[0] == "pbkdf2_sha256" and len(parts) == 4 and parts[1] == str(PBKDF2_ITERATIONS))
+    if KDF == "scrypt":
+        return not (parts[0] == "scrypt" and len(parts) == 6 and
+                    parts[1:4] == [str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P)])
+    return True
+
+
+# --------------------------- KDF POOL ---------------------------
+# hashlib releases the GIL while deriving keys, so a thread pool is enough to use several cores.
+_pool = ThreadPoolExecutor(max_workers=KDF_WORKERS, thread_name_prefix="kdf")
+_pool_slots = threading.BoundedSemaphore(KDF_WORKERS + KDF_QUEUE)
+
+
+def _run_in_pool(fn, *args):
+    if not _pool_slots.acquire(timeout=KDF_QUEUE_TIMEOUT):
+        raise AuthBusy("The login service is busy. Please try again.")
+    try:
+        return _pool.submit(fn, *args).result()
+    finally:
+        _pool_slots.release()
+
+
+def hash_password_in_pool(password):
+    return _run_in_pool(hash_password, password)
+
+
+def verify_password_in_pool(password, stored):
+    return _run_in_pool(verify_password, password, stored)
+
+
+# --------------------------- THROTTLING ---------------------------
+class LoginThrottle:
+    """Sliding-window count of recent failures per key, kept in a bounded in-memory LRU."""
+
+    def __init__(self, max_failures, window=THROTTLE_WINDOW, max_keys=THROTTLE_MAX_KEYS):
+        self.max_failures = max_failures
+        self.window = window
+        self.max_keys = max_keys
+        self._failures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prune(self, key, now):
+        failures = self._failures.get(key)
+        while failures and now - failures[0] > self.window:
+            failures.popleft()
+        if failures is not None and not failures:
+            del self._failures[key]
+        return failures
+
+    def check(self, key):
+        if key is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            failures = self._prune(key, now)
+            if failures and len(failures) >= self.max_failures:
+                raise LoginThrottled(self.window - (now - failures[0]))
+
+    def record_failure(self, key):
+        if key is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._failures.setdefault(key, deque()).append(now)
+            self._failures.move_to_end(key)
+            # Keys are ordered by their latest failure, so expired ones sit at the front
+            while self._failures:
+                oldest = next(iter(self._failures.values()))
+                if now - oldest[-1] <= self.window and len(self._failures) <= self.max_keys:
+                    break
+                self._failures.popitem(last=False)
+
+    def reset(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+
+
+_user_throttle = LoginThrottle(MAX_FAILURES_PER_USER)
+_ip_throttle = LoginThrottle(MAX_FAILURES_PER_IP)
+
+
+# --------------------------- LOGIN CACHE ---------------------------
+# Keys are keyed with a per-process secret, so the cache holds nothing that could be checked offline.
+# The stored hash is part of the key, so changing or upgrading a password invalidates old entries.
+_cache_secret = secrets.token_bytes(32)
+_login_cache = OrderedDict()
+_login_cache_lock = threading.Lock()
+
+
+def _login_cache_key(username, password, stored):
+    message = "\0".join((username, password, stored)).encode("utf-8")
+    return hmac.new(_cache_secret, message, hashlib.sha256).digest()
+
+
+def _login_cached(key):
+    with _login_cache_lock:
+        expires = _login_cache.get(key)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del _login_cache[key]
+            return False
+        _login_cache.move_to_end(key)
+        return True
+
+
+def _remember_login(key):
+    with _login_cache_lock:
+        _login_cache[key] = time.monotonic() + LOGIN_CACHE_TTL
+        _login_cache.move_to_end(key)
+        while len(_login_cache) > LOGIN_CACHE_SIZE:
+            _login_cache.popitem(last=False)
+
+
+# --------------------------- LOGIN ---------------------------
+# Returns True for valid credentials. Raises LoginThrottled or AuthBusy when the attempt is not checked.
+def authenticate(username, password, ip_address=None):
+    # Keyed per IP when we know it, so failures from one client cannot lock the account for everyone
+    user_key = (username, ip_address) if ip_address else username
+
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute("SELECT password FROM users WHERE username=?", (username,))
+    row = c.fetchone()
+    conn.close()
+
+    stored = row[0] if row else None
+    # A login already proven recently is not subject to throttling and needs no KDF
+    if stored is not None and _login_cached(_login_cache_key(username, password, stored)):
+        return True
+
+    _user_throttle.check(user_key)
+    _ip_throttle.check(ip_address)
+
+    if stored is None:
+        # Spend the same time as a real check so unknown usernames cannot be told apart
+        verify_password_in_pool(password, _dummy_hash())
+        valid = False
+    else:
+        valid = verify_password_in_pool(password, stored)
+
+    if not valid:
+        # Unknown usernames only count against the IP, so made-up names cannot fill the per-user table
+        if stored is not None:
+            _user_throttle.record_failure(user_key)
+        _ip_throttle.record_failure(ip_address)
+        return False
+
+    _user_throttle.reset(user_key)
+    if needs_rehash(stored):
+        stored = _upgrade_hash(username, password, stored)
+    _remember_login(_login_cache_key(username, password, stored))
+    return True
+
+
+def _upgrade_hash(username, password, old_stored):
+    new_stored = hash_password_in_pool(password)
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    # Only replace the row we verified against, in case the password changed meanwhile
+    c.execute("UPDATE users SET password=? WHERE username=? AND password=?", (new_stored, username, old_stored))
+    conn.commit()
+    updated = c.rowcount
+    conn.close()
+    return new_stored if updated else old_stored
+
+
+# Hash checked for unknown usernames. Derived in the pool on the first such login, not at import,
+# so starting a worker costs nothing; later callers reuse it.
+_dummy_stored = None
+_dummy_lock = threading.Lock()
+
+
+def _dummy_hash():
+    global _dummy_stored
+    with _dummy_lock:
+        if _dummy_stored is None:
+            _dummy_stored = hash_password_in_pool(secrets.token_urlsafe(16))
+        return _dummy_stored
+
+
+# --------------------------- BENCHMARK ---------------------------
+# python auth.py [seconds]
+# Measures single-core verifications per second for a range of cost settings.
+def benchmark(seconds=2.0):
+    settings = [("pbkdf2_sha256", iterations) for iterations in (100_000, 300_000, 600_000, 1_200_000)]
+    settings += [("scrypt", n) for n in (2 ** 13, 2 ** 14, 2 ** 15, 2 ** 16)]
+    print(f"{'kdf':<15}{'cost':>12}{'ms/login':>12}{'logins/s/core':>16}")
+    for kdf, cost in settings:
+        stored = hash_password("benchmark-password", kdf=kdf, cost=cost)
+        count = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            verify_password("benchmark-password", stored)
+            count += 1
+        elapsed = time.perf_counter() - start
+        print(f"{kdf:<15}{cost:>12}{elapsed / count * 1000:>12.1f}{count / elapsed:>16.1f}")
+
+
+if __name__ == "__main__":
+    benchmark(float(sys.argv[1]) if len(sys.argv) > 1 else 2.0)
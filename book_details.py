@@ -0,0 +1,153 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DB_PATH = "users_book.db"
+
+# Number of reviews kept on each detail page, and number of detail pages kept in memory.
+LATEST_REVIEWS = 20
+CACHE_SIZE = 512
+# Cached detail pages are re-read after this many seconds, so metadata expiry is noticed.
+CACHE_TTL = 300
+# Saved Google Books metadata is treated as missing after this many seconds (7 days).
+METADATA_TTL = 7 * 24 * 3600
+
+
+class LRUCache:
+    """Small thread-safe LRU shared by all Streamlit sessions of this process.
+
+    invalidate() bumps a single cache-wide generation. Readers take the generation before reading
+    the database and pass it to put(); if any invalidation happened in between, the value is not
+    cached, so a row read before a concurrent write never is. No per-key state outlives its entry.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            value, expires = self._data[key]
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value, generation):
+        with self._lock:
+            if self._generation != generation:
+                return
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation += 1
+
+
+_cache = LRUCache()
+
+
+# --------------------------- SCHEMA ---------------------------
+def create_book_details_table(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS book_details
+                 (
+                     book_title     TEXT PRIMARY KEY,
+                     review_count   INTEGER NOT NULL DEFAULT 0,
+                     latest_reviews TEXT    NOT NULL DEFAULT '[]',
+                     metadata       TEXT,
+                     -- when metadata was last saved; review refreshes leave it alone
+                     updated_at     DATETIME DEFAULT CURRENT_TIMESTAMP
+                 )''')
+    # The reviews primary key starts with username, so per-book reads need their own index.
+    c.execute("CREATE INDEX IF NOT EXISTS idx_reviews_title ON reviews (book_title, timestamp)")
+
+    # Backfill detail pages for reviews written before this table existed.
+    c.execute('''SELECT DISTINCT book_title
+                 FROM reviews
+                 WHERE book_title NOT IN (SELECT book_title FROM book_details)''')
+    for (book_title,) in c.fetchall():
+        refresh_book_details(conn, book_title)
+    conn.commit()
+
+
+# --------------------------- WRITES ---------------------------
+# Recompute the aggregates of one book; call inside the transaction that changed its reviews,
+# then invalidate_book_details() after committing.
+def refresh_book_details(conn, book_title):
+    c = conn.cursor()
+    c.execute("SELECT COUNT(*) FROM reviews WHERE book_title=?", (book_title,))
+    review_count = c.fetchone()[0]
+    c.execute("SELECT username, review_text, timestamp FROM reviews WHERE book_title=? "
+              "ORDER BY timestamp DESC LIMIT ?", (book_title, LATEST_REVIEWS))
+    latest_reviews = json.dumps(c.fetchall())
+    c.execute('''INSERT INTO book_details (book_title, review_count, latest_reviews)
+                 VALUES (?, ?, ?)
+                 ON CONFLICT(book_title) DO UPDATE SET review_count   = excluded.review_count,
+                                                       latest_reviews = excluded.latest_reviews''',
+              (book_title, review_count, latest_reviews))
+
+
+# Drop the in-memory copy once the transaction that changed a book has been committed.
+def invalidate_book_details(book_title):
+    _cache.invalidate(book_title)
+
+
+# Only pass metadata from a successful Google Books lookup, never the API-failure placeholder.
+def save_book_metadata(book_title, metadata):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute('''INSERT INTO book_details (book_title, metadata)
+                 VALUES (?, ?)
+                 ON CONFLICT(book_title) DO UPDATE SET metadata   = excluded.metadata,
+                                                       updated_at = CURRENT_TIMESTAMP''',
+              (book_title, json.dumps(metadata)))
+    conn.commit()
+    conn.close()
+    _cache.invalidate(book_title)
+
+
+# --------------------------- READS ---------------------------
+# Returns {'review_count': int, 'reviews': [(username, review_text, timestamp), ...], 'metadata': dict or None}.
+# 'metadata' is None when nothing was saved yet or the saved copy is older than METADATA_TTL.
+def get_book_details(book_title):
+    details = _cache.get(book_title)
+    if details is not None:
+        return details
+
+    generation = _cache.generation()
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute("SELECT review_count, latest_reviews, metadata, updated_at >= datetime('now', ?) "
+              "FROM book_details WHERE book_title=?",
+              (f"-{METADATA_TTL} seconds", book_title))
+    row = c.fetchone()
+    conn.close()
+
+    if row:
+        review_count, latest_reviews, metadata, metadata_fresh = row
+        details = {
+            'review_count': review_count,
+            'reviews': [tuple(review) for review in json.loads(latest_reviews)],
+            'metadata': json.loads(metadata) if metadata and metadata_fresh else None
+        }
+    else:
+        details = {'review_count': 0, 'reviews': [], 'metadata': None}
+    _cache.put(book_title, details, generation)
+    return details
@@ -0,0 +1,216 @@
+import heapq
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+DB_PATH = "users_book.db"
+SNAPSHOT_PATH = "popularity_snapshot.pkl"
+
+# Weight of a single event when it is recorded. Reviews are a stronger signal than views.
+HISTORY_WEIGHT = 1.0
+REVIEW_WEIGHT = 3.0
+# Each user counts at most once per book and event type within this many seconds (1 day).
+DEDUPE_WINDOW = 24 * 3600
+# Score given to the #1 book of popular.pkl; the rest scale down linearly with their rank.
+STATIC_WEIGHT = 5.0
+# Live counts are squashed into [0, STATIC_WEIGHT): a book needs about this much decayed weight
+# (e.g. this many distinct users viewing it) to earn half of the static scale.
+LIVE_SATURATION = 20.0
+# A title outside popular.pkl needs this many distinct users before it can enter the Top-N.
+MIN_DISTINCT_USERS = 3
+# Live counts lose half their weight after this many seconds (7 days).
+HALF_LIFE = 7 * 24 * 3600
+# How often the ranking is rebuilt and the counts written to disk.
+REFRESH_INTERVAL = 30
+SNAPSHOT_INTERVAL = 300
+TOP_N = 50
+MAX_HALF_LIVES = 512
+# Rows this close to the snapshot's high-water mark are replayed again; duplicates are skipped.
+REPLAY_MARGIN = 60
+
+
+def _format_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _parse_timestamp(value):
+    # SQLite CURRENT_TIMESTAMP is UTC in "YYYY-MM-DD HH:MM:SS" format.
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+class PopularityEngine:
+    """Time-decayed popularity of books, blended with the static popular.pkl ranking.
+
+    Counts are kept with forward decay: every event is stored as weight * 2^((t - epoch) / HALF_LIFE),
+    so recording an event is a single dict update and nothing has to be rescaled as time passes.
+    The blended Top-N list is rebuilt at most every REFRESH_INTERVAL seconds and read from memory.
+
+    The history and reviews tables are the source of truth. The snapshot is only a cache: it stores
+    the counts together with a high-water timestamp, and rows written after that are replayed on load.
+
+    Only titles from popular.pkl or known_titles (the similarity model's books) are counted, so
+    free text typed by a user never reaches the shared ranking.
+    """
+
+    def __init__(self, static_titles, known_titles=(), snapshot_path=SNAPSHOT_PATH, half_life=HALF_LIFE,
+                 static_weight=STATIC_WEIGHT, top_n=TOP_N):
+        self.snapshot_path = snapshot_path
+        self.half_life = half_life
+        self.static_weight = static_weight
+        self.top_n = top_n
+        self._lock = threading.Lock()
+
+        # Static scores, in the order of popular.pkl.
+        total = len(static_titles)
+        self._static = {title: static_weight * (total - rank) / total
+                        for rank, title in enumerate(static_titles)}
+        self._known = set(known_titles) | self._static.keys()
+
+        self._epoch = time.time()
+        self._live = {}
+        # (kind, username, title) -> dedupe window of its last counted event
+        self._seen = {}
+        # Titles outside popular.pkl -> usernames that viewed or reviewed them
+        self._live_users = {}
+        self._top = list(static_titles[:top_n])
+        self._dirty = True
+        self._last_refresh = 0.0
+        self._last_snapshot = time.time()
+
+        high_water = self._load_snapshot()
+        self._replay_from_db(high_water)
+        self._maybe_snapshot(force=True)
+
+    # --------------------------- EVENTS ---------------------------
+    def _boost(self, timestamp):
+        return 2 ** ((timestamp - self._epoch) / self.half_life)
+
+    def record(self, kind, username, book_title, timestamp=None):
+        if book_title not in self._known:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        weight = REVIEW_WEIGHT if kind == "review" else HISTORY_WEIGHT
+        window = int(timestamp // DEDUPE_WINDOW)
+        key = (kind, username, book_title)
+        with self._lock:
+            if self._seen.get(key) == window:
+                return
+            self._seen[key] = window
+            if book_title not in self._static:
+                self._live_users.setdefault(book_title, set()).add(username)
+            if (timestamp - self._epoch) / self.half_life > MAX_HALF_LIVES:
+                self._rebase(timestamp)
+            self._live[book_title] = self._live.get(book_title, 0.0) + weight * self._boost(timestamp)
+            self._dirty = True
+        self._maybe_snapshot()
+
+    def record_view(self, username, book_title):
+        self.record("view", username, book_title)
+
+    def record_review(self, username, book_title):
+        self.record("review", username, book_title)
+
+    def _rebase(self, now):
+        # Forward-decay boosts grow without bound, so move the epoch forward before they overflow.
+        factor = self._boost(now)
+        self._live = {title: count / factor for title, count in self._live.items() if count / factor > 1e-6}
+        self._epoch = now
+
+    # --------------------------- RANKING ---------------------------
+    def score(self, book_title, now=None):
+        if now is None:
+            now = time.time()
+        live = self._live.get(book_title, 0.0) / self._boost(now)
+        return self._static.get(book_title, 0.0) + self.static_weight * live / (live + LIVE_SATURATION)
+
+    def _refresh(self):
+        now = time.time()
+        with self._lock:
+            if not self._dirty and now - self._last_refresh < REFRESH_INTERVAL:
+                return
+            # Static scores do not decay, so the blended order has to be recomputed against "now".
+            titles = self._static.keys() | {title for title, users in self._live_users.items()
+                                            if len(users) >= MIN_DISTINCT_USERS}
+            self._top = heapq.nlargest(self.top_n, titles, key=lambda title: self.score(title, now))
+            self._dirty = False
+            self._last_refresh = now
+
+    def top(self, n=TOP_N):
+        if self._dirty or time.time() - self._last_refresh >= REFRESH_INTERVAL:
+            self._refresh()
+        return self._top[:n]
+
+    def fallback(self, exclude=(), n=6):
+        # Recommendations for titles the similarity model does not know about.
+        return [title for title in self.top() if title not in exclude][:n]
+
+    # --------------------------- PERSISTENCE ---------------------------
+    def _replay_from_db(self, high_water=None):
+        # Counts rows newer than the snapshot (or everything without one). Rows near the high-water
+        # mark may already be counted; the dedupe keys in self._seen skip those.
+        since = _format_timestamp(high_water - REPLAY_MARGIN) if high_water else ""
+        try:
+            conn = sqlite3.connect(DB_PATH)
+            c = conn.cursor()
+            c.execute("SELECT username, book_title, timestamp FROM history WHERE timestamp >= ? "
+                      "ORDER BY timestamp", (since,))
+            views = c.fetchall()
+            # Reviews are keyed by the Google Books title; source_title is the dataset title.
+            c.execute("SELECT username, COALESCE(source_title, book_title), timestamp FROM reviews "
+                      "WHERE timestamp >= ? ORDER BY timestamp", (since,))
+            reviews = c.fetchall()
+            conn.close()
+        except sqlite3.Error:
+            return
+        for username, book_title, timestamp in views:
+            self.record("view", username, book_title, _parse_timestamp(timestamp))
+        for username, book_title, timestamp in reviews:
+            self.record("review", username, book_title, _parse_timestamp(timestamp))
+
+    # Returns the snapshot's high-water timestamp, or None when there is no usable snapshot.
+    def _load_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return None
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if data.get('half_life') != self.half_life or 'live_users' not in data:
+            return None
+        self._epoch = data['epoch']
+        self._live = data['live']
+        self._seen = data['seen']
+        self._live_users = data['live_users']
+        self._dirty = True
+        return data['high_water']
+
+    def snapshot(self):
+        with self._lock:
+            now = time.time()
+            # Only keys from the last two windows can collide with rows replayed after a restart.
+            current_window = int(now // DEDUPE_WINDOW)
+            self._seen = {key: window for key, window in self._seen.items() if window >= current_window - 1}
+            data = {'epoch': self._epoch, 'half_life': self.half_life, 'high_water': now,
+                    'live': dict(self._live), 'seen': dict(self._seen),
+                    'live_users': {title: set(users) for title, users in self._live_users.items()}}
+            self._last_snapshot = now
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(data, f)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def _maybe_snapshot(self, force=False):
+        if force or time.time() - self._last_snapshot >= SNAPSHOT_INTERVAL:
+            try:
+                self.snapshot()
+            except OSError:
+                pass
+